@@ -1,21 +1,119 @@
-import boto3
-import base64
-import datetime
+import concurrent.futures
+import functools
+import json
+import os
 import pprint
-import uuid
-from boto3.session import Session
+import sys
+import threading
 from datetime import datetime
 from datetime import timedelta
 
 default_region = 'us-east-1'
 
+# Responses are printed by default. Set LM_SAMPLE_VERBOSE=0 to only return them.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '1') == '1'
+
+# Alarm dimensions, shared between calls since botocore does not modify request parameters
+default_alarm_dimensions = [
+    {
+        'Name': 'SubscriptionName',
+        'Value': 'Red Hat Enterprise Linux Server',
+    }
+]
+
+# boto3 and botocore are imported on first use, so importing this module stays cheap
+
+# One session is shared by every client, so credentials and service models are loaded once.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+clients = {}
+clients_lock = threading.Lock()
+
+# Helper method to get the shared session
+@functools.lru_cache(maxsize=None)
+def get_session():
+    from boto3.session import Session
+    return Session()
+
+# Shared client configuration: a larger connection pool for concurrent calls, TCP keep-alive
+# so pooled connections stay warm between calls, adaptive retries for throttling, and short
+# timeouts so a dropped connection is retried instead of stalling for the 60 second default
+@functools.lru_cache(maxsize=None)
+def get_client_config():
+    from botocore.config import Config
+    return Config(
+        connect_timeout = 3,
+        read_timeout = 10,
+        max_pool_connections = 32,
+        tcp_keepalive = True,
+        retries = {'mode': 'adaptive', 'max_attempts': 5}
+    )
+
+# Set DRY_RUN=1 to run the sample against canned responses. Requests are answered before
+# they are signed or sent, so no credentials or network access are needed.
+dry_run = os.environ.get('DRY_RUN') == '1'
+if dry_run:
+    # Skip the instance metadata credentials probe, it only slows down local runs
+    os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+
+dry_run_responses = {
+    'GetServiceSettings': {'LinuxSubscriptionsDiscovery': 'Disabled'},
+    'GetMetricData': {'MetricDataResults': []},
+    'PutMetricAlarm': {},
+    'DescribeAlarms': {'MetricAlarms': [], 'CompositeAlarms': []},
+}
+
+# Helper method to answer a request with its canned dry-run response
+def dry_run_response(model, **kwargs):
+    from botocore.awsrequest import AWSResponse
+    return AWSResponse(None, 200, {}, None), dict(dry_run_responses.get(model.name, {}))
+
+# Helper method to get the shared client for a service and region, created on first use
+def get_shared_client(Service, Region):
+    client = clients.get((Service, Region))
+    if client is None:
+        with clients_lock:
+            client = clients.get((Service, Region))
+            if client is None:
+                client = get_session().client(Service, Region, config=get_client_config())
+                if dry_run:
+                    client.meta.events.register('before-call', dry_run_response)
+                clients[(Service, Region)] = client
+    return client
+
+# Serializes a response page with the C json encoder, which is much cheaper than pprint
+# for the large pages returned by the paginated calls
+dump_response = functools.partial(json.dumps, default=str, indent=2)
+
+# Helper method to write a response page to stdout
+def write_response(response):
+    sys.stdout.write(dump_response(response))
+    sys.stdout.write('\n')
+
+# Helper method to print a response. The helpers run on worker threads, so they only return
+# their responses and main() prints them in a fixed order once the calls are joined.
+def print_response(Title, response):
+    if verbose:
+        print(Title)
+        pprint.pprint(response)
+
+# Helper method to print the pages of a paginated response
+def print_pages(Title, pages):
+    if verbose:
+        for response in pages:
+            print(Title)
+            write_response(response)
+
 # Helper method to get linux subscriptions usage metrics
-def get_linux_subscriptions_usage_metrics(Namespace, MetricName, StartTime):
+# One query is issued per subscription name, all of them in a single GetMetricData request
+def get_linux_subscriptions_usage_metrics(Namespace, MetricName, SubscriptionNames, StartTime):
     cloudwatch = get_cw_client(default_region)
-    response = cloudwatch.get_metric_data(
+    paginator = cloudwatch.get_paginator('get_metric_data')
+    pages = []
+    for response in paginator.paginate(
         MetricDataQueries=[
             {
-                'Id': 'm1',
+                'Id': f'm{index}',
+                'Label': SubscriptionName,
                 'MetricStat': {
                     'Metric': {
                         'Namespace': Namespace,
@@ -23,11 +121,7 @@ def get_linux_subscriptions_usage_metrics(Namespace, MetricName, StartTime):
                         'Dimensions': [
                             {
                                 'Name': 'SubscriptionName',
-                                'Value': 'Red Hat Enterprise Linux Server',
-                            },
-                            {
-                                'Name': 'SubscriptionName',
-                                'Value': 'SUSE Linux Enterprise Server',
+                                'Value': SubscriptionName,
                             },
                         ]
                     },
@@ -36,14 +130,14 @@ def get_linux_subscriptions_usage_metrics(Namespace, MetricName, StartTime):
                     'Unit': 'Count'
                 },
                 'ReturnData': True,
-            },
+            }
+            for index, SubscriptionName in enumerate(SubscriptionNames, start=1)
         ],
         StartTime = StartTime,
         EndTime = datetime.now(),
-    )
-    print('Cloud Watch Get Metrics Statistics API response:')
-    pprint.pprint(response)
-    return
+    ):
+        pages.append(response)
+    return pages
 
 # Helper method to create linux subscriptions usage alarms
 def create_linux_subscriptions_usage_alarms(AlarmName, Namespace, MetricName):
@@ -59,70 +153,75 @@ def create_linux_subscriptions_usage_alarms(AlarmName, Namespace, MetricName):
         Threshold = 100.0,
         ActionsEnabled = False,
         AlarmDescription='Alarm when count exceeds 100',
-        Dimensions = [
-            {
-                'Name': 'SubscriptionName',
-                'Value': 'Red Hat Enterprise Linux Server',
-            }
-        ], 
+        Dimensions = default_alarm_dimensions,
         Unit = 'Count'
     )
-    print('Cloud Watch Put Alarm API response:')
-    pprint.pprint(response)
-    return
+    return response
 
 # Helper method to describe linux subscriptions usage alarms
 def describe_linux_subscriptions_usage_alarms(AlarmNames):
     cloudwatch = get_cw_client(default_region)
-    response = cloudwatch.describe_alarms(
-        AlarmNames = AlarmNames
-    )
-    while True:
-        print('Cloud Watch Put Alarm API response:')
-        pprint.pprint(response)
-        if "NextToken" in response:
-            next_token = response['NextToken']
-            response = cloudwatch.describe_alarms(
-            AlarmNames = AlarmNames,
-            NextToken = next_token
-        )
-        else:
-            break
-    return
+    paginator = cloudwatch.get_paginator('describe_alarms')
+    pages = []
+    for response in paginator.paginate(AlarmNames = AlarmNames):
+        pages.append(response)
+    return pages
 
 # Helper method to get license manager linux subscription settings
 def get_linux_subscriptions_settings():
     lm_linux_subscriptions_client = get_lm_client(default_region)
     response = lm_linux_subscriptions_client.get_service_settings()
-    print('AWS License Manager Linux Subscriptions - GetServiceSettings API response:')
-    pprint.pprint(response)
     return response
 
 
 def get_cw_client(Region):
-    return boto3.client('cloudwatch', Region)
+    return get_shared_client('cloudwatch', Region)
 
 def get_lm_client(Region):
-    return boto3.client('license-manager-linux-subscriptions', Region)
+    return get_shared_client('license-manager-linux-subscriptions', Region)
+
+# Helper method to resolve credentials and create the clients used by main() before the
+# workers start, which moves credential resolution and client setup ahead of the first call
+def warm_up():
+    credentials = get_session().get_credentials()
+    if credentials is not None:
+        credentials.get_frozen_credentials()
+    get_cw_client(default_region)
+    get_lm_client(default_region)
 
 def main(command_line=None):
     print("Start of the AWS License Manager Linux Subscriptions samples")
-    
-    # Get current linux subscriptions settings 
-    get_linux_subscriptions_settings()
+    warm_up()
     
     Statistics=['Sum']
     StartTime = datetime.now() - timedelta(days=1)
-    
-    # Get current linux subscriptions usage metrics for RHEL and SUSE 
-    get_linux_subscriptions_usage_metrics('AWS/LicenseManager/LinuxSubscriptions', 'RunningInstancesCount', StartTime)
-    
+    SubscriptionNames = ['Red Hat Enterprise Linux Server', 'SUSE Linux Enterprise Server']
     AlarmName = 'Sample Linux Usage Alarm'
-    # create alarm for linux subscriptions usage metrics
-    create_linux_subscriptions_usage_alarms(AlarmName, 'AWS/LicenseManager/LinuxSubscriptions', 'RunningInstancesCount')
     
-    # describe alarms for linux subscriptions usage metrics
-    describe_linux_subscriptions_usage_alarms([AlarmName])
+    # The calls below are independent of each other, so they are issued concurrently.
+    # boto3 clients are thread safe and the cached clients are shared by the workers.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        # Get current linux subscriptions settings 
+        settings_future = executor.submit(get_linux_subscriptions_settings)
+        
+        # Get current linux subscriptions usage metrics for RHEL and SUSE 
+        metrics_future = executor.submit(get_linux_subscriptions_usage_metrics, 'AWS/LicenseManager/LinuxSubscriptions', 'RunningInstancesCount', SubscriptionNames, StartTime)
+        
+        # create alarm for linux subscriptions usage metrics
+        alarm_future = executor.submit(create_linux_subscriptions_usage_alarms, AlarmName, 'AWS/LicenseManager/LinuxSubscriptions', 'RunningInstancesCount')
+        
+        # describe alarms for linux subscriptions usage metrics, once the alarm exists
+        alarm_response = alarm_future.result()
+        describe_future = executor.submit(describe_linux_subscriptions_usage_alarms, [AlarmName])
+        
+        settings_response = settings_future.result()
+        metrics_pages = metrics_future.result()
+        describe_pages = describe_future.result()
+    
+    print_response('AWS License Manager Linux Subscriptions - GetServiceSettings API response:', settings_response)
+    print_pages('Cloud Watch Get Metric Data API response:', metrics_pages)
+    print_response('Cloud Watch Put Alarm API response:', alarm_response)
+    print_pages('Cloud Watch Describe Alarms API response:', describe_pages)
     
     #For more details on filters please check: https://docs.aws.amazon.com/license-manager/latest/userguide/linux-subscriptions-usage-alarms.html
     
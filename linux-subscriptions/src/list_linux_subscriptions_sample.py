@@ -1,76 +1,168 @@
-import boto3
-import base64
-import datetime
+import concurrent.futures
+import functools
+import json
+import os
 import pprint
-import uuid
-from boto3.session import Session
+import sys
+import threading
 
 default_region = 'us-east-1'
 
+# Responses are printed by default. Set LM_SAMPLE_VERBOSE=0 to only return them.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '1') == '1'
+
+# boto3 and botocore are imported on first use, so importing this module stays cheap
+
+# One session is shared by every client, so credentials and service models are loaded once.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+clients = {}
+clients_lock = threading.Lock()
+
+# Helper method to get the shared session
+@functools.lru_cache(maxsize=None)
+def get_session():
+    from boto3.session import Session
+    return Session()
+
+# Shared client configuration: a larger connection pool for concurrent calls, TCP keep-alive
+# so pooled connections stay warm between calls, adaptive retries for throttling, and short
+# timeouts so a dropped connection is retried instead of stalling for the 60 second default
+@functools.lru_cache(maxsize=None)
+def get_client_config():
+    from botocore.config import Config
+    return Config(
+        connect_timeout = 3,
+        read_timeout = 10,
+        max_pool_connections = 32,
+        tcp_keepalive = True,
+        retries = {'mode': 'adaptive', 'max_attempts': 5}
+    )
+
+# Set DRY_RUN=1 to run the sample against canned responses. Requests are answered before
+# they are signed or sent, so no credentials or network access are needed.
+dry_run = os.environ.get('DRY_RUN') == '1'
+if dry_run:
+    # Skip the instance metadata credentials probe, it only slows down local runs
+    os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+
+dry_run_responses = {
+    'GetServiceSettings': {'LinuxSubscriptionsDiscovery': 'Disabled'},
+    'ListLinuxSubscriptions': {'Subscriptions': []},
+    'ListLinuxSubscriptionInstances': {'Instances': []},
+}
+
+# Helper method to answer a request with its canned dry-run response
+def dry_run_response(model, **kwargs):
+    from botocore.awsrequest import AWSResponse
+    return AWSResponse(None, 200, {}, None), dict(dry_run_responses.get(model.name, {}))
+
+# Helper method to get the shared client for a service and region, created on first use
+def get_shared_client(Service, Region):
+    client = clients.get((Service, Region))
+    if client is None:
+        with clients_lock:
+            client = clients.get((Service, Region))
+            if client is None:
+                client = get_session().client(Service, Region, config=get_client_config())
+                if dry_run:
+                    client.meta.events.register('before-call', dry_run_response)
+                clients[(Service, Region)] = client
+    return client
+
+# Serializes a response page with the C json encoder, which is much cheaper than pprint
+# for the large pages returned by the paginated calls
+dump_response = functools.partial(json.dumps, default=str, indent=2)
+
+# Helper method to write a response page to stdout
+def write_response(response):
+    sys.stdout.write(dump_response(response))
+    sys.stdout.write('\n')
+
+# Helper method to print a response. The helpers run on worker threads, so they only return
+# their responses and main() prints them in a fixed order once the calls are joined.
+def print_response(Title, response):
+    if verbose:
+        print(Title)
+        pprint.pprint(response)
+
+# Helper method to print the pages of a paginated response
+def print_pages(Title, pages):
+    if verbose:
+        for response in pages:
+            print(Title)
+            write_response(response)
+
 # Helper method to list linux subscriptions
 def list_linux_subscriptions():
     lm_linux_subscriptions_client = get_client(default_region)
     response = lm_linux_subscriptions_client.list_linux_subscriptions()
-    print('AWS License Manager Linux Subscriptions - ListLinuxSubscriptions API response:')
-    pprint.pprint(response)
-    return
+    return response
 
 # Helper method to list linux subscription instances
 def list_linux_subscription_instances(FilterName, Condition, FilterValues):
     lm_linux_subscriptions_client = get_client(default_region)
-    response = lm_linux_subscriptions_client.list_linux_subscription_instances(
-                    Filters=[
-                        {
-                            'Name': FilterName,
-                            'Operator': Condition, # 'Equal'|'NotEqual'|'Contains'
-                            'Values': FilterValues 
-                        }
-                    ]
-    )
-    while True:
-        print('AWS License Manager Linux Subscriptions - ListLinuxSubscriptions API response:')
-        pprint.pprint(response)
-        if "NextToken" in response:
-            next_token = response['NextToken']
-            response = lm_linux_subscriptions_client.list_linux_subscription_instances(
-                    Filters=[
-                        {
-                            'Name': FilterName,
-                            'Operator': Condition,
-                            'Values': FilterValues 
-                        }
-                    ]
-            )
-        else:
-            break
-    return
+    # The request is built once, the paginator only updates NextToken between pages
+    request = {
+        'Filters': [
+            {
+                'Name': FilterName,
+                'Operator': Condition, # 'Equal'|'NotEqual'|'Contains'
+                'Values': FilterValues 
+            }
+        ]
+    }
+    paginator = lm_linux_subscriptions_client.get_paginator('list_linux_subscription_instances')
+    pages = []
+    for response in paginator.paginate(**request):
+        pages.append(response)
+    return pages
 
 # Helper method to get license manager linux subscription settings
 def get_linux_subscriptions_settings():
     lm_linux_subscriptions_client = get_client(default_region)
     response = lm_linux_subscriptions_client.get_service_settings()
-    print('AWS License Manager Linux Subscriptions - GetServiceSettings API response:')
-    pprint.pprint(response)
     return response
 
 
 def get_client(Region):
-    return boto3.client('license-manager-linux-subscriptions', Region)
+    return get_shared_client('license-manager-linux-subscriptions', Region)
+
+# Helper method to resolve credentials and create the clients used by main() before the
+# workers start, which moves credential resolution and client setup ahead of the first call
+def warm_up():
+    credentials = get_session().get_credentials()
+    if credentials is not None:
+        credentials.get_frozen_credentials()
+    get_client(default_region)
 
 def main(command_line=None):
     print("Start of the AWS License Manager Linux Subscriptions samples")
+    warm_up()
     
-    # Get current linux subscriptions settings 
-    get_linux_subscriptions_settings()
-    
-    # Lists Linux Subscriptions
-    list_linux_subscriptions()
-    
-    # List all Linux Subscription Instances in some particular geographical area
-    list_linux_subscription_instances('Region', 'Contains', ['us'])
+    # The calls below are independent of each other, so they are issued concurrently.
+    # boto3 clients are thread safe and the cached client is shared by the workers.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        # Get current linux subscriptions settings 
+        settings_future = executor.submit(get_linux_subscriptions_settings)
+        
+        # Lists Linux Subscriptions
+        subscriptions_future = executor.submit(list_linux_subscriptions)
+        
+        # List all Linux Subscription Instances in some particular geographical area
+        region_instances_future = executor.submit(list_linux_subscription_instances, 'Region', 'Contains', ['us'])
+        
+        # List all Linux Subscription Instances with SUSE Billing Code
+        suse_instances_future = executor.submit(list_linux_subscription_instances, 'UsageOperation', 'Equal', ['RunInstances:000g'])
+        
+        settings_response = settings_future.result()
+        subscriptions_response = subscriptions_future.result()
+        region_instances_pages = region_instances_future.result()
+        suse_instances_pages = suse_instances_future.result()
     
-    # List all Linux Subscription Instances with SUSE Billing Code
-    list_linux_subscription_instances('UsageOperation', 'Equal', ['RunInstances:000g'])
+    print_response('AWS License Manager Linux Subscriptions - GetServiceSettings API response:', settings_response)
+    print_response('AWS License Manager Linux Subscriptions - ListLinuxSubscriptions API response:', subscriptions_response)
+    print_pages('AWS License Manager Linux Subscriptions - ListLinuxSubscriptionInstances API response:', region_instances_pages)
+    print_pages('AWS License Manager Linux Subscriptions - ListLinuxSubscriptionInstances API response:', suse_instances_pages)
     
     #For more details on filters please check: https://docs.aws.amazon.com/license-manager/latest/userguide/linux-subscriptions-instances-view.html
     
@@ -1,12 +1,80 @@
-import boto3
-import base64
-import datetime
+import concurrent.futures
+import functools
+import os
 import pprint
-import uuid
-from boto3.session import Session
+import threading
 
 default_region = 'us-east-1'
 
+# Responses are printed by default. Set LM_SAMPLE_VERBOSE=0 to only return them.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '1') == '1'
+
+# boto3 and botocore are imported on first use, so importing this module stays cheap
+
+# One session is shared by every client, so credentials and service models are loaded once.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+clients = {}
+clients_lock = threading.Lock()
+
+# Helper method to get the shared session
+@functools.lru_cache(maxsize=None)
+def get_session():
+    from boto3.session import Session
+    return Session()
+
+# Shared client configuration: a larger connection pool for concurrent calls, TCP keep-alive
+# so pooled connections stay warm between calls, adaptive retries for throttling, and short
+# timeouts so a dropped connection is retried instead of stalling for the 60 second default
+@functools.lru_cache(maxsize=None)
+def get_client_config():
+    from botocore.config import Config
+    return Config(
+        connect_timeout = 3,
+        read_timeout = 10,
+        max_pool_connections = 32,
+        tcp_keepalive = True,
+        retries = {'mode': 'adaptive', 'max_attempts': 5}
+    )
+
+# Set DRY_RUN=1 to run the sample against canned responses. Requests are answered before
+# they are signed or sent, so no credentials or network access are needed.
+dry_run = os.environ.get('DRY_RUN') == '1'
+if dry_run:
+    # Skip the instance metadata credentials probe, it only slows down local runs
+    os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+
+dry_run_responses = {
+    'CreateServiceLinkedRole': {'Role': {}},
+    'EnableAWSServiceAccess': {},
+    'UpdateServiceSettings': {'LinuxSubscriptionsDiscovery': 'Enabled'},
+    'GetServiceSettings': {'LinuxSubscriptionsDiscovery': 'Enabled'},
+}
+
+# Helper method to answer a request with its canned dry-run response
+def dry_run_response(model, **kwargs):
+    from botocore.awsrequest import AWSResponse
+    return AWSResponse(None, 200, {}, None), dict(dry_run_responses.get(model.name, {}))
+
+# Helper method to get the shared client for a service and region, created on first use
+def get_shared_client(Service, Region):
+    client = clients.get((Service, Region))
+    if client is None:
+        with clients_lock:
+            client = clients.get((Service, Region))
+            if client is None:
+                client = get_session().client(Service, Region, config=get_client_config())
+                if dry_run:
+                    client.meta.events.register('before-call', dry_run_response)
+                clients[(Service, Region)] = client
+    return client
+
+# Helper method to print a response. The bootstrap helpers run on worker threads, so they only
+# return their responses and bootstrap_linux_subscriptions() prints them once they are joined.
+def print_response(Title, response):
+    if verbose:
+        print(Title)
+        pprint.pprint(response)
+
 # Helper method to update license manager linux subscription settings
 def update_linux_subscriptions_settings(OrganizationIntegration, SourceRegions):
     lm_linux_subscriptions_client = get_lm_client(default_region)
@@ -17,62 +85,119 @@ def update_linux_subscriptions_settings(OrganizationIntegration, SourceRegions):
                         'SourceRegions': SourceRegions
                     }
                 )
-    print('AWS License Manager Linux Subscriptions - UpdateServiceSettings API response:')
-    pprint.pprint(response)
+    if verbose:
+        print('AWS License Manager Linux Subscriptions - UpdateServiceSettings API response:')
+        pprint.pprint(response)
     return response
 
 # Helper method to get license manager linux subscription settings
 def get_linux_subscriptions_settings():
     lm_linux_subscriptions_client = get_lm_client(default_region)
     response = lm_linux_subscriptions_client.get_service_settings()
-    print('AWS License Manager Linux Subscriptions - GetServiceSettings API response:')
-    pprint.pprint(response)
+    if verbose:
+        print('AWS License Manager Linux Subscriptions - GetServiceSettings API response:')
+        pprint.pprint(response)
     return response
 
+# Helper method to validate that Linux Subscriptions is reachable in each source region.
+# The regions are checked concurrently, each through its own cached regional client.
+def validate_source_regions(SourceRegions):
+    def get_region_settings(Region):
+        return Region, get_lm_client(Region).get_service_settings()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(SourceRegions)) as executor:
+        results = list(executor.map(get_region_settings, SourceRegions))
+    for region, response in results:
+        print(f"AWS License Manager Linux Subscriptions - GetServiceSettings in {region}: {response.get('LinuxSubscriptionsDiscovery')}")
+    return dict(results)
+
 # Helper method to enabled the integration of Linux Subscriptions with AWS Organizations.
 def enable_linux_subscriptions_orgs_service_access():
     orgs_client = get_orgs_client(default_region)
     response = orgs_client.enable_aws_service_access(
                     ServicePrincipal = 'license-manager-linux-subscriptions.amazonaws.com'
                 )
-    print('AWS Organizations EnableAWSServiceAccess API response:')
-    pprint.pprint(response)
     return response
     
-# Helper method to crate Linux Subscriptions SLR.
+# Helper method to crate Linux Subscriptions SLR. Returns None when the role already exists.
 def create_linux_subscriptions_slr():
     iam_client = get_iam_client(default_region)
-    response = iam_client.create_service_linked_role(
-                    AWSServiceName='license-manager-linux-subscriptions.amazonaws.com'
-                )
-    print('AWS IAM CreateServiceLinkedRole API response:')
-    pprint.pprint(response)
+    try:
+        response = iam_client.create_service_linked_role(
+                        AWSServiceName='license-manager-linux-subscriptions.amazonaws.com'
+                    )
+    except iam_client.exceptions.InvalidInputException as e:
+        # IAM reports an existing service-linked role as "has been taken in this account"
+        if 'has been taken' not in str(e):
+            raise
+        return None
     return response
 
+# Helper method to set up the prerequisites for Linux Subscriptions. Both steps are idempotent
+# but cost a round trip each, so they are skipped when the current settings show that
+# discovery and the Organizations integration are already enabled.
+def bootstrap_linux_subscriptions():
+    settings = get_linux_subscriptions_settings()
+    discovery_settings = settings.get('LinuxSubscriptionsDiscoverySettings', {})
+    if (settings.get('LinuxSubscriptionsDiscovery') == 'Enabled'
+            and discovery_settings.get('OrganizationIntegration') == 'Enabled'):
+        print('Linux Subscriptions is already onboarded, skipping the service-linked role and Organizations setup')
+        return settings
+
+    # The service-linked role and the Organizations integration do not depend on each other,
+    # so both are set up concurrently and joined before the settings are updated.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # License Manager requires a service-linked role for managing AWS resources that will provide Linux subscriptions.
+        # Fore more details please visit: https://docs.aws.amazon.com/license-manager/latest/userguide/linux-subscriptions-role.html
+        slr_future = executor.submit(create_linux_subscriptions_slr)
+        
+        # Enable the integration of Linux Subscriptions with Organizations
+        # https://docs.aws.amazon.com/organizations/latest/APIReference/API_EnableAWSServiceAccess.html 
+        orgs_future = executor.submit(enable_linux_subscriptions_orgs_service_access)
+        
+        slr_response = slr_future.result()
+        orgs_response = orgs_future.result()
+
+    if slr_response is None:
+        print('AWS IAM CreateServiceLinkedRole: service-linked role already exists')
+    else:
+        print_response('AWS IAM CreateServiceLinkedRole API response:', slr_response)
+    print_response('AWS Organizations EnableAWSServiceAccess API response:', orgs_response)
+    return settings
+
 
 def get_lm_client(Region):
-    return boto3.client('license-manager-linux-subscriptions', Region)
+    return get_shared_client('license-manager-linux-subscriptions', Region)
 
 def get_orgs_client(Region):
-    return boto3.client('organizations', Region)
-    
+    return get_shared_client('organizations', Region)
+
 def get_iam_client(Region):
-    return boto3.client('iam', Region)
+    return get_shared_client('iam', Region)
+
+# Helper method to resolve credentials and create the clients used by main() before the
+# workers start, which moves credential resolution and client setup ahead of the first call
+def warm_up():
+    credentials = get_session().get_credentials()
+    if credentials is not None:
+        credentials.get_frozen_credentials()
+    get_lm_client(default_region)
+    get_orgs_client(default_region)
+    get_iam_client(default_region)
 
 def main(command_line=None):
     print("Start of the AWS License Manager Linux Subscriptions samples")
+    warm_up()
     
-    # License Manager requires a service-linked role for managing AWS resources that will provide Linux subscriptions.
-    # Fore more details please visit: https://docs.aws.amazon.com/license-manager/latest/userguide/linux-subscriptions-role.html
-    create_linux_subscriptions_slr()
-    
-    # Enable the integration of Linux Subscriptions with Organizations
-    # https://docs.aws.amazon.com/organizations/latest/APIReference/API_EnableAWSServiceAccess.html 
-    enable_linux_subscriptions_orgs_service_access()
+    # Create the service-linked role and enable the Organizations integration, unless a previous run already did
+    bootstrap_linux_subscriptions()
 
     # sample source regions - collects linux subscriptions resources from these regions
     source_regions = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ap-south-1']
 
+    # Validate every source region before pushing the settings
+    validate_source_regions(source_regions)
+
     # Onboard to Linux Subscriptions with Cross Account (if not enabled - Single Account Mode), Cross Region features enabled
     update_linux_subscriptions_settings('Enabled', source_regions)
 
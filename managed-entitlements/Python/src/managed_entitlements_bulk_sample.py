@@ -0,0 +1,192 @@
+import aioboto3
+import asyncio
+import datetime
+import os
+import pprint
+import uuid
+from botocore.config import Config
+
+default_region = 'us-east-1'
+
+# Responses are only returned by default, so formatting and stdout writes stay off the path
+# of the concurrent calls. Set LM_SAMPLE_VERBOSE=1 to print every response.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '0') == '1'
+
+# Number of licenses issued by the sample, and how many of them are processed at the same time
+# to stay within the License Manager request rate limits
+default_license_count = 10
+default_concurrency = 5
+
+# Request parameters that are the same for every license this sample creates. botocore does
+# not modify request parameters, so these are shared between calls instead of rebuilt.
+default_consumption_configuration = {
+    "ProvisionalConfiguration": {
+        "MaxTimeToLiveInMinutes": 60
+    }
+}
+default_issuer = {
+    "Name": "My Company",
+}
+default_license_metadata = [{
+    "Name": "ProductName",
+    "Value": "My awesome product"
+}]
+
+# Shared client configuration: a connection pool large enough for the concurrent licenses, each
+# of which can have two calls in flight, adaptive retries for throttling, and short timeouts so
+# a dropped connection is retried.
+# Every request is built from the same fixed shape, so client-side parameter validation is
+# turned off to skip walking the request against the service model on each call.
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = 2 * default_concurrency,
+    parameter_validation = False,
+    retries = {'mode': 'adaptive', 'max_attempts': 5}
+)
+
+async def create_license(lm_client, LicenseName, ProductSKU, ProductKeyEntitlements, ValidityBegin, ClientToken):
+    response = await lm_client.create_license(
+        LicenseName = LicenseName,
+        ProductName = "My Product",
+        Beneficiary = "My Beneficiary",
+        ConsumptionConfiguration = default_consumption_configuration,
+        Entitlements = ProductKeyEntitlements,
+        HomeRegion = default_region,
+        Issuer = default_issuer,
+        ProductSKU = ProductSKU,
+        Validity = {
+            "Begin": ValidityBegin
+        },
+        LicenseMetadata = default_license_metadata,
+        ClientToken = ClientToken
+    )
+    if verbose:
+        print('AWS License Manager - Create License API response:')
+        pprint.pprint(response)
+    return response
+
+async def checkout_license(lm_client, KeyFingerprint, ProductSKU, ProductKeyEntitlementName, ProductKeyUnit, ProductKeyValue, ClientToken):
+    response = await lm_client.checkout_license(
+        CheckoutType = "PROVISIONAL",
+        Entitlements = [{
+            "Name": ProductKeyEntitlementName,
+            "Unit": ProductKeyUnit,
+            "Value": ProductKeyValue
+        }],
+        KeyFingerprint = KeyFingerprint,
+        ProductSKU = ProductSKU,
+        Beneficiary = "My Beneficiary",
+        ClientToken = ClientToken
+    )
+    if verbose:
+        print('AWS License Manager - Checkout License API response:')
+        pprint.pprint(response)
+    return response
+
+async def get_license(lm_client, LicenseArn):
+    response = await lm_client.get_license(
+        LicenseArn = LicenseArn,
+    )
+    if verbose:
+        print('AWS License Manager - Get License API response:')
+        pprint.pprint(response)
+    return response
+
+async def check_in_license(lm_client, LicenseConsumptionToken):
+    response = await lm_client.check_in_license(
+        LicenseConsumptionToken = LicenseConsumptionToken
+    )
+    if verbose:
+        print('AWS License Manager - CheckIn License API response:')
+        pprint.pprint(response)
+    return response
+
+async def extend_license_consumption(lm_client, LicenseConsumptionToken):
+    response = await lm_client.extend_license_consumption(
+        LicenseConsumptionToken = LicenseConsumptionToken
+    )
+    if verbose:
+        print('AWS License Manager - Extend License Consumption API response:')
+        pprint.pprint(response)
+    return response
+
+async def delete_license(lm_client, LicenseArn, SourceVersion):
+    response = await lm_client.delete_license(
+        LicenseArn = LicenseArn,
+        SourceVersion = SourceVersion
+    )
+    if verbose:
+        print('AWS License Manager - Delete License API response:')
+        pprint.pprint(response)
+    return response
+
+# Runs the full lifecycle of the sample for a single license. The steps of one license
+# are sequential, the licenses themselves are processed concurrently. Once the license is
+# created it is always deleted, even when a later step fails.
+async def issue_and_checkout(lm_client, semaphore, Index, KeyFingerprint, ValidityBegin):
+    license_name = f"TestLicense{Index}"
+    product_sku = f"TestProductSKU{Index}"
+    entitlement_key = "Users"
+    entitlement_unit = "Count"
+    entitlement_value = "1"
+    source_version = "1"
+
+    product_key_entitlement=[{
+     "Name": entitlement_key,
+     "Unit": entitlement_unit,
+     "MaxCount": 1000,
+     "AllowCheckIn": True
+     }]
+
+    async with semaphore:
+        # Creating a test license for a sample product
+        license = await create_license(lm_client, license_name, product_sku, product_key_entitlement, ValidityBegin, uuid.uuid4().hex)
+
+        try:
+            # Get the test license details and checkout the test license with valid Entitlements.
+            _, checkout_response = await asyncio.gather(
+                get_license(lm_client, license['LicenseArn']),
+                checkout_license(lm_client, KeyFingerprint, product_sku, entitlement_key, entitlement_unit, entitlement_value, uuid.uuid4().hex)
+            )
+
+            # Extend the test license consumption.
+            await extend_license_consumption(lm_client, checkout_response['LicenseConsumptionToken'])
+
+            # Check in the test license
+            await check_in_license(lm_client, checkout_response['LicenseConsumptionToken'])
+        finally:
+            # Delete the license.
+            await delete_license(lm_client, license['LicenseArn'], source_version)
+
+async def issue_licenses(LicenseCount):
+    session = aioboto3.Session()
+    semaphore = asyncio.Semaphore(default_concurrency)
+    validity_begin = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    async with session.client('sts', region_name=default_region, config=client_config) as sts_client:
+        account_id = (await sts_client.get_caller_identity())["Account"]
+    keyfingerprint = f"aws:{account_id}:My Company:issuer-fingerprint"
+
+    # A failed license is reported without cancelling the others, so every created license
+    # still runs to its delete step
+    async with session.client('license-manager', region_name=default_region, config=client_config) as lm_client:
+        results = await asyncio.gather(*[
+            issue_and_checkout(lm_client, semaphore, index, keyfingerprint, validity_begin)
+            for index in range(1, LicenseCount + 1)
+        ], return_exceptions=True)
+
+    failures = 0
+    for index, result in enumerate(results, start=1):
+        if isinstance(result, Exception):
+            print(f"TestLicense{index} failed: {result}")
+            failures += 1
+    return failures
+
+def main(command_line=None):
+    print("Start of the sample model for bulk license issuance")
+    failures = asyncio.run(issue_licenses(default_license_count))
+    print(f"Created, checked out, checked in and deleted {default_license_count - failures} of {default_license_count} licenses")
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,55 @@
-import boto3
+import concurrent.futures
+import functools
+import json
 import logging
+import os
+import threading
 import uuid
-import jwt
 import base64
+from boto3.session import Session
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 region='us-east-1'
 
+# One session is shared by every client, so credentials and service models are loaded once.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+session = Session()
+clients = {}
+clients_lock = threading.Lock()
+
+# Shared client configuration: a larger connection pool for concurrent calls, TCP keep-alive
+# so pooled connections stay warm between calls, adaptive retries for throttling, and short
+# timeouts so a dropped connection is retried instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = 32,
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 5}
+)
+
+# Creating an RSA_4096 key is the slowest call of the sample and every key is billed, so the
+# key ARN is reused between runs. The cache file keeps one key per account and region, and
+# LM_SAMPLE_CMK_ARN takes precedence over it.
+cmk_cache_file = os.path.expanduser('~/.lm_sample_cache.json')
+
+pem_header = b"-----BEGIN PUBLIC KEY-----\n"
+pem_footer = b"\n-----END PUBLIC KEY-----\n"
+
 # boto3.set_stream_logger(name='botocore',level=10)
 
-def create_license(SignKey):
+def create_license(SignKey, ClientToken):
     """Creates a license.
 
     For the purposes of this sample, it creates a dummy license only allowing
     to specify the SignKey to be used to signed the response of borrow.
 
     :SignKey KMS Asymmetric Key Arn
+    :ClientToken Unique, case-sensitive idempotency token
     """
 
-    lm_client = boto3.client('license-manager', region)
+    lm_client = get_client('license-manager', region)
     return lm_client.create_license(
         LicenseName="My License",
         ProductName="My Product",
@@ -51,18 +83,21 @@ def create_license(SignKey):
             "Name":"ProductName",
             "Value":"My awesome product"
         }],
-        ClientToken=str(uuid.uuid4())
+        ClientToken=ClientToken
     )
 
-def checkout_borrow_license(LicenseArn):
+def checkout_borrow_license(LicenseArn, ClientToken):
     """Borrow a license for offline usage
 
     The API returns an SignedToken which is a JWT token encoded using algorithm
     PS384. The data is essentially the same returned as response of this object.
     For more details: https://docs.aws.amazon.com/license-manager/latest/APIReference/API_CheckoutBorrowLicense.html
+
+    :LicenseArn Amazon Resource Name (ARN) of the license
+    :ClientToken Unique, case-sensitive idempotency token
     """
 
-    lm_client = boto3.client('license-manager', region)
+    lm_client = get_client('license-manager', region)
     return lm_client.checkout_borrow_license(
         LicenseArn=LicenseArn,
         Entitlements=[{
@@ -72,54 +107,162 @@ def checkout_borrow_license(LicenseArn):
         }],
         NodeId="MyNodeId",
         DigitalSignatureMethod="JWT_PS384",
-        ClientToken=str(uuid.uuid4()).replace("-","")
+        ClientToken=ClientToken
     )
 
 
 def create_cmk(desc='Customer Master Key'):
-    """Create a KMS Customer Master Key
+    """Create a KMS Customer Master Key, or reuse the one from a previous run
 
-    The created CMK is a Customer-managed key stored in AWS KMS.
+    The created CMK is a Customer-managed key stored in AWS KMS. Its ARN is
+    saved to the cache file under the current account and region, and
+    LM_SAMPLE_CMK_ARN or the cached key is used instead of creating a new
+    key when present. A cached key that is no longer enabled is replaced.
     """
 
-    kms_client = boto3.client('kms', region)
+    cached_arn = os.environ.get('LM_SAMPLE_CMK_ARN')
+    if cached_arn:
+        return cached_arn
+
+    kms_client = get_client('kms', region)
+    cache_key = f"{get_account_id()}:{region}"
+    try:
+        with open(cmk_cache_file) as cache:
+            cached_arns = dict(json.load(cache))
+    except (OSError, ValueError, TypeError):
+        cached_arns = {}
+    cached_arn = cached_arns.get(cache_key)
+    if cached_arn and is_cmk_enabled(cached_arn):
+        return cached_arn
+
     response = kms_client.create_key(
                                     Description=desc,
                                     CustomerMasterKeySpec="RSA_4096",
                                     KeyUsage="SIGN_VERIFY"
                                 )
 
-    return response['KeyMetadata']['Arn']
+    key_arn = response['KeyMetadata']['Arn']
+    cached_arns[cache_key] = key_arn
+    try:
+        with open(cmk_cache_file, 'w') as cache:
+            json.dump(cached_arns, cache)
+    except OSError as e:
+        logging.warning("Could not save the key ARN to %s: %s", cmk_cache_file, e)
+    return key_arn
+
+def is_cmk_enabled(KeyId):
+    """Check that a cached CMK still exists and can sign
+
+    A key that was disabled, scheduled for deletion or deleted, or that the
+    current credentials cannot describe, is reported as not enabled.
+    """
+
+    kms_client = get_client('kms', region)
+    try:
+        response = kms_client.describe_key(KeyId=KeyId)
+    except ClientError:
+        return False
+    return response['KeyMetadata']['KeyState'] == 'Enabled'
+
+@functools.lru_cache(maxsize=1)
+def get_account_id():
+    """Get the account ID of the current credentials, fetched once"""
 
+    sts_client = get_client('sts', region)
+    return sts_client.get_caller_identity()["Account"]
+
+@functools.lru_cache(maxsize=128)
 def get_public_key(KeyId):
     """Get CMK PublicKey
+
+    The public key of a KMS key never changes, so it is cached per KeyId.
     """
 
-    kms_client = boto3.client('kms', region)
+    kms_client = get_client('kms', region)
     response = kms_client.get_public_key(KeyId=KeyId)
 
     return response['PublicKey']
 
+@functools.lru_cache(maxsize=128)
+def get_public_key_pem(KeyId):
+    """Get CMK PublicKey wrapped in PEM format, cached per KeyId
+
+    The PEM is kept as bytes, which is what the key loader expects.
+    """
+
+    return pem_header + base64.b64encode(get_public_key(KeyId)) + pem_footer
+
+@functools.lru_cache(maxsize=128)
+def get_verification_key(KeyId):
+    """Get CMK PublicKey parsed into a key object, cached per KeyId
+
+    PyJWT accepts the parsed key directly, which avoids parsing the PEM on
+    every token verification.
+    """
+
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+    return load_pem_public_key(get_public_key_pem(KeyId))
+
+def get_client(Service, Region):
+    """Get the shared client for the given service and region
+
+    Clients are created from the shared session on first use, under a lock,
+    and reused by every thread.
+    """
+
+    client = clients.get((Service, Region))
+    if client is None:
+        with clients_lock:
+            client = clients.get((Service, Region))
+            if client is None:
+                client = session.client(Service, Region, config=client_config)
+                clients[(Service, Region)] = client
+    return client
+
+def warm_up():
+    """Resolve credentials and create the clients used by the sample
+
+    This runs on the main thread before the workers start, which moves
+    credential resolution and client setup ahead of the first call.
+    """
+
+    get_client('kms', region)
+    get_client('license-manager', region)
+    credentials = session.get_credentials()
+    if credentials is not None:
+        credentials.get_frozen_credentials()
+
 def main(command_line=None):
     print("Start of the sample model for checkout borrow license")
+    warm_up()
+    # Client tokens are generated once up front and passed to the helpers
+    create_client_token, borrow_client_token = (uuid.uuid4().hex for _ in range(2))
+
     # Initially, you should create an asymmetric key that License Manager uses to
     # sign borrow license data. The algorithms are based on JWT standard and all
     # major languages has public libraries to verify signatures. For this sample,
     # we are using PyJwt
     # Key should be created in the same region as license
     SignKey=create_cmk()
-    print(f"Key Created: {SignKey}")
+    print(f"Signing Key: {SignKey}")
 
     # For offline verification public key should be stored safely in way that the Software
     # can retrieve it. For more details how to manage your public key, please check
     # KMS docs: https://docs.aws.amazon.com/kms/latest/APIReference/API_GetPublicKey.html
-    public_key=f"-----BEGIN PUBLIC KEY-----\n{base64.b64encode(get_public_key(SignKey)).decode()}\n-----END PUBLIC KEY-----\n"
-    print(f"Public Key: {public_key}")
-
+    #
     # Creates a simple license for our example. We have an entitlement called Users
     # and are indicating to License Manager that it should allow license borrowing
     # by specifying BorrowConfiguration.
-    License=create_license(SignKey=SignKey)
+    #
+    # Both calls only depend on the key, so they are issued concurrently.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        public_key_future = executor.submit(get_public_key_pem, SignKey)
+        license_future = executor.submit(create_license, SignKey=SignKey, ClientToken=create_client_token)
+
+        public_key=public_key_future.result()
+        License=license_future.result()
+    print(f"Public Key: {public_key.decode()}")
+
     LicenseArn=License["LicenseArn"]
     print(f"License Created: {LicenseArn}")
 
@@ -127,7 +270,7 @@ def main(command_line=None):
     # distribution and potential leaks. Use borrowing specifying and validating
     # NodeId if distribution is not safe.
     # Key and checkoutborrow should happen in the same region
-    signed_token=checkout_borrow_license(LicenseArn)["SignedToken"]
+    signed_token=checkout_borrow_license(LicenseArn, borrow_client_token)["SignedToken"]
     print(f"Signed Token from CheckoutBorrowLicense: {signed_token}")
 
     # Now that you have signed token in your environment, you can retrieve the public
@@ -142,7 +285,9 @@ def main(command_line=None):
     # If it is invalid token, it throws an exception
     #  jwt.exceptions.InvalidSignatureError: Signature verification failed
     #
-    checkout_borrow_decoded_response = jwt.decode(signed_token, public_key, algorithms=["PS384"], options={"verify_signature": True})
+    # PyJWT is only needed for the verification step, so it is imported here
+    import jwt
+    checkout_borrow_decoded_response = jwt.decode(signed_token, get_verification_key(SignKey), algorithms=["PS384"], options={"verify_signature": True})
     print(f"Decoded response (Signature verified): {checkout_borrow_decoded_response}")
 
 if __name__ == '__main__':
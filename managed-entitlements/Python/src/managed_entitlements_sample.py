@@ -1,43 +1,79 @@
-import boto3
-import base64
+import concurrent.futures
 import datetime
+import functools
+import os
 import pprint
+import threading
 import uuid
+from boto3.session import Session
+from botocore.config import Config
 
 default_region = 'us-east-1'
 
-def create_license(LicenseName, ProductSKU, ProductKeyEntitlements):
+# Responses are printed by default. Set LM_SAMPLE_VERBOSE=0 to only return them.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '1') == '1'
+
+# Request parameters that are the same for every license this sample creates. botocore does
+# not modify request parameters, so these are shared between calls instead of rebuilt.
+default_consumption_configuration = {
+    "ProvisionalConfiguration": {
+        "MaxTimeToLiveInMinutes": 60
+    }
+}
+default_issuer = {
+    "Name": "My Company",
+}
+default_license_metadata = [{
+    "Name": "ProductName",
+    "Value": "My awesome product"
+}]
+
+# One session is shared by every client, so credentials and service models are loaded once.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+session = Session()
+clients = {}
+clients_lock = threading.Lock()
+
+# Shared client configuration: a larger connection pool for concurrent calls, TCP keep-alive
+# so pooled connections stay warm between calls, adaptive retries for throttling, and short
+# timeouts so a dropped connection is retried instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = 32,
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 5}
+)
+
+# Helper method to print a response
+def print_response(Title, response):
+    if verbose:
+        print(Title)
+        pprint.pprint(response)
+
+def create_license(LicenseName, ProductSKU, ProductKeyEntitlements, ValidityBegin, ClientToken):
     lm_client = get_client(default_region)
     response = lm_client.create_license(
         LicenseName = LicenseName,
         ProductName = "My Product",
         Beneficiary = "My Beneficiary",
-        ConsumptionConfiguration = {
-            "ProvisionalConfiguration": {
-                "MaxTimeToLiveInMinutes": 60
-            }
-        },
+        ConsumptionConfiguration = default_consumption_configuration,
         Entitlements = ProductKeyEntitlements,
         HomeRegion = default_region,
-        Issuer = {
-            "Name": "My Company",
-        },
+        Issuer = default_issuer,
         ProductSKU = ProductSKU,
         Validity = {
-            "Begin": datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+            "Begin": ValidityBegin
         },
-        LicenseMetadata = [{
-            "Name": "ProductName",
-            "Value": "My awesome product"
-        }],
-        ClientToken = str(uuid.uuid4())
+        LicenseMetadata = default_license_metadata,
+        ClientToken = ClientToken
     )
-    print('AWS License Manager - Create License API response:')
-    pprint.pprint(response)
+    print_response('AWS License Manager - Create License API response:', response)
     return response
 
 
-def checkout_license(KeyFingerprint, ProductSKU, ProductKeyEntitlementName, ProductKeyUnit, ProductKeyValue):
+# Runs on a worker thread, so the response is only returned and printed by main()
+def checkout_license(KeyFingerprint, ProductSKU, ProductKeyEntitlementName, ProductKeyUnit, ProductKeyValue, ClientToken):
     lm_client = get_client(default_region)
     response = lm_client.checkout_license(
         CheckoutType = "PROVISIONAL",
@@ -49,19 +85,16 @@ def checkout_license(KeyFingerprint, ProductSKU, ProductKeyEntitlementName, Prod
         KeyFingerprint = KeyFingerprint,
         ProductSKU = ProductSKU,
         Beneficiary = "My Beneficiary",
-        ClientToken = str(uuid.uuid4())
+        ClientToken = ClientToken
     )
-    print('AWS License Manager - Checkout License API response:')
-    pprint.pprint(response)
     return response
 
+# Runs on a worker thread, so the response is only returned and printed by main()
 def get_license(LicenseArn):
     lm_client = get_client(default_region)
     response = lm_client.get_license(
         LicenseArn = LicenseArn,
     )
-    print('AWS License Manager - Get License API response:')
-    pprint.pprint(response)
     return response
 
 def check_in_license(LicenseConsumptionToken):
@@ -69,16 +102,16 @@ def check_in_license(LicenseConsumptionToken):
     response = lm_client.check_in_license(
         LicenseConsumptionToken = LicenseConsumptionToken
     )
-    print('AWS License Manager - CheckIn License API response:')
-    pprint.pprint(response)
+    print_response('AWS License Manager - CheckIn License API response:', response)
+    return response
 
 def extend_license_consumption(LicenseConsumptionToken):
     lm_client = get_client(default_region)
     response = lm_client.extend_license_consumption(
         LicenseConsumptionToken = LicenseConsumptionToken
     )
-    print('AWS License Manager - Extend License Consumption API response:')
-    pprint.pprint(response)
+    print_response('AWS License Manager - Extend License Consumption API response:', response)
+    return response
 
 def delete_license(LicenseArn, SourceVersion):
     lm_client = get_client(default_region)
@@ -86,14 +119,40 @@ def delete_license(LicenseArn, SourceVersion):
         LicenseArn = LicenseArn,
         SourceVersion = SourceVersion
     )
-    print('AWS License Manager - Delete License API response:')
-    pprint.pprint(response)
+    print_response('AWS License Manager - Delete License API response:', response)
+    return response
+
+# The caller identity does not change during the program, so it is only fetched once
+@functools.lru_cache(maxsize=1)
+def get_account_id():
+    sts_client = get_shared_client('sts', default_region)
+    return sts_client.get_caller_identity()["Account"]
 
 def get_client(Region):
-    return boto3.client('license-manager', Region)
+    return get_shared_client('license-manager', Region)
+
+# Helper method to get the shared client for a service and region, created on first use
+def get_shared_client(Service, Region):
+    client = clients.get((Service, Region))
+    if client is None:
+        with clients_lock:
+            client = clients.get((Service, Region))
+            if client is None:
+                client = session.client(Service, Region, config=client_config)
+                clients[(Service, Region)] = client
+    return client
+
+# Helper method to resolve credentials and create the License Manager client before the
+# workers start, which moves credential resolution and client setup ahead of the first call
+def warm_up():
+    get_client(default_region)
+    credentials = session.get_credentials()
+    if credentials is not None:
+        credentials.get_frozen_credentials()
 
 def main(command_line=None):
     print("Start of the sample model 1")
+    warm_up()
     model1_license_name = "TestLicense1"
     model1_product_sku = "TestProductSKU1"
     model1_entitlement_key = "Users"
@@ -102,8 +161,12 @@ def main(command_line=None):
     model1_entitlement_value = "1"
     model1_source_version = "1"
 
-    client = boto3.client("sts")
-    account_id = client.get_caller_identity()["Account"]
+    # Client tokens and the validity start time are generated once up front and passed
+    # to the helpers, so batch callers can pre-generate them in a single pass.
+    model1_validity_begin = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    create_client_token, checkout_client_token = (uuid.uuid4().hex for _ in range(2))
+
+    account_id = get_account_id()
 
     model1_keyfingerprint = f"aws:{account_id}:My Company:issuer-fingerprint"
 
@@ -115,13 +178,21 @@ def main(command_line=None):
      }]
 
     # Creating a test license for a sample product
-    license = create_license(model1_license_name, model1_product_sku,product_key_entitlement)
+    license = create_license(model1_license_name, model1_product_sku, product_key_entitlement, model1_validity_begin, create_client_token)
+
+    # Getting the license details and checking it out only depend on the license existing,
+    # so both calls are issued concurrently.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # Get the test license details.
+        get_license_future = executor.submit(get_license, license['LicenseArn'])
 
-    # Get the test license details.
-    get_license(license['LicenseArn'])
+        # Checkout the test license with valid Entitlements.
+        checkout_future = executor.submit(checkout_license, model1_keyfingerprint, model1_product_sku, model1_entitlement_key, model1_entitlement_unit, model1_entitlement_value, checkout_client_token)
 
-    # Checkout the test license with valid Entitlements.
-    checkout_response = checkout_license(model1_keyfingerprint, model1_product_sku, model1_entitlement_key, model1_entitlement_unit, model1_entitlement_value)
+        get_license_response = get_license_future.result()
+        checkout_response = checkout_future.result()
+    print_response('AWS License Manager - Get License API response:', get_license_response)
+    print_response('AWS License Manager - Checkout License API response:', checkout_response)
 
     # Extend the test license consumption.
     extend_license_consumption(checkout_response['LicenseConsumptionToken'])
@@ -1,22 +1,104 @@
-import boto3
 import base64
+import concurrent.futures
 import datetime
+import os
+import functools
 import pprint
+import threading
+import time
 import uuid
 from boto3.session import Session
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 default_region = 'us-east-1'
 default_role = 'LicenseConversionRole'
 
+# Responses are only returned by default, since the sample can touch every resource in the
+# Organization and formatting each response would dominate the run. Set LM_SAMPLE_VERBOSE=1
+# to print every response.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '0') == '1'
+
+# Page size for the List calls. A larger page needs fewer round trips to walk the inventory.
+default_page_size = 100
+
+# Number of conversion tasks started at the same time
+default_max_workers = 16
+
+# Longest wait, in seconds, between two rounds of conversion task status checks
+default_max_poll_interval = 30
+
+# Error codes returned once a throttled call has used up its retries. These stop the sample
+# instead of being reported per resource, since continuing would only add to the throttling.
+throttling_error_codes = frozenset({'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', 'RateLimitExceededException'})
+
+# Shared client configuration: a connection pool large enough for the workers, adaptive retries
+# so throttled calls back off on the client instead of failing, TCP keep-alive so pooled
+# connections stay warm between calls, and short timeouts so a dropped connection is retried
+# instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = max(32, default_max_workers * 2),
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 10}
+)
+
+# One session is shared by every client, including the assumed-role clients, which get their
+# credentials passed in. The service models are then loaded once instead of once per account.
+# Sessions are not thread safe, so clients are created under a lock, the clients themselves are.
+shared_session = Session()
+shared_session_lock = threading.Lock()
+
+# Assumed-role clients are cached per account until shortly before their credentials expire,
+# so polling a conversion task does not call sts:AssumeRole every time
+assumed_role_clients = {}
+assumed_role_locks = {}
+assumed_role_clients_lock = threading.Lock()
+assumed_role_expiry_margin = datetime.timedelta(seconds=60)
+
+# Conversion tasks started and conversion task statuses checked per second. Both are kept below
+# the service request rates, so the workers do not spend their time on throttled calls and retries.
+default_conversion_rate = 5
+default_status_check_rate = 10
+
+# Token bucket that spaces out calls to stay below a request rate. Up to Rate calls can start
+# at once, after that callers wait for tokens that are refilled at Rate per second.
+class TokenBucket:
+    def __init__(self, Rate):
+        self.rate = Rate
+        self.tokens = Rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A negative balance reserves a future token, the caller waits until it is refilled
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+conversion_rate_limiter = TokenBucket(default_conversion_rate)
+status_check_rate_limiter = TokenBucket(default_status_check_rate)
+
 # Management Account(MA)/Delegated Admin(DA)  assumes default role (LicenseConversionRole) in each resoure owner account id
 # with below permissions to start/get license conversion Tasks. 
 # https://docs.aws.amazon.com/license-manager/latest/userguide/conversion-prerequisites.html 
 
 # To create default role and set trust relationship with MA/DA: https://docs.aws.amazon.com/IAM/latest/UserGuide/id_roles_create.html 
 
+# Raised when a license conversion task could not be started or did not succeed
+class LicenseConversionError(Exception):
+    pass
+
 # Helper method to create license conversion task
 def create_license_conversion_task(AccountId, ResourceArn, SourceContext, DestinationContext):
     assume_role_client = get_client_using_assume_role(AccountId, default_region)
+    conversion_rate_limiter.acquire()
     response = assume_role_client.create_license_conversion_task_for_resource(
                     ResourceArn = ResourceArn,
                     SourceLicenseContext={
@@ -26,94 +108,174 @@ def create_license_conversion_task(AccountId, ResourceArn, SourceContext, Destin
                         'UsageOperation': DestinationContext
                     }
                 )
-    print('AWS License Manager - CreateLicenseConversionTask API response:')
-    pprint.pprint(response)
+    if verbose:
+        print('AWS License Manager - CreateLicenseConversionTask API response:')
+        pprint.pprint(response)
+    if 'LicenseConversionTaskId' not in response:
+        raise LicenseConversionError(f'no license conversion task was started for {ResourceArn}')
     return response
 
 # Helper method to track license conversion task status
 def get_license_conversion_task_status(AccountId, LicenseConversionTaskId):
     assume_role_client = get_client_using_assume_role(AccountId, default_region)
+    status_check_rate_limiter.acquire()
     response = assume_role_client.get_license_conversion_task(
         LicenseConversionTaskId = LicenseConversionTaskId,
     )
-    print('AWS License Manager - GetLicenseConfiguration API response:')
-    pprint.pprint(response)
+    if verbose:
+        print('AWS License Manager - GetLicenseConversionTask API response:')
+        pprint.pprint(response)
     # Status message in the response provides more details on the Status
-    if ((response['Status'] == 'SUCCEEDED') or (response['Status'] == 'FAILED')):
-        return True
-    else: 
-        return False
+    return response['Status'], response.get('StatusMessage')
 
-# Sample function to convert Windows Server from BYOL to license included
+# Sample function to convert the license type of all matching resources from the SourceContext
+# usage operation to the DestinationContext usage operation
 # for all eligible conversion types please visit: https://docs.aws.amazon.com/license-manager/latest/userguide/conversion-types.html 
-def convert_BYOL_to_license_included_for_all_resources():
+def convert_license_for_all_resources(SourceContext, DestinationContext):
     lm_client = get_client(default_region)
     
     # Pass filters to apply conversion on certain resources
     # https://docs.aws.amazon.com/license-manager/latest/APIReference/API_ListResourceInventory.html#licensemanager-ListResourceInventory-request-Filters 
-    response = lm_client.list_resource_inventory(
-            MaxResults=20,
+    paginator = lm_client.get_paginator('list_resource_inventory')
+    pages = paginator.paginate(
             Filters=[
                 {
                     'Name': 'tag:samplekey',
                     'Condition': 'EQUALS',
                     'Value': 'samplevalue'
                 },
-            ]
+            ],
+            PaginationConfig={'PageSize': default_page_size}
         )
     
-    pending_conversion_tasks = {}
-    while True:
-        print('AWS License Manager - ListResourceInventory API response:')
-        pprint.pprint(response)
-        if "ResourceInventoryList" in response:
-            for resource in response['ResourceInventoryList']:
-                resource_arn = resource['ResourceArn']
-                account_id = resource_arn.split(':')[4]
-                conversion_task_response = create_license_conversion_task (account_id, resource_arn, 'RunInstances:0800', 'RunInstances:0002')
-                pending_conversion_tasks[conversion_task_response['LicenseConversionTaskId']] = account_id
-                pprint.pprint(conversion_task_response)
-        if "NextToken" in response:
-            next_token = response['NextToken']
-            response = lm_client.list_resource_inventory(
-                NextToken=next_token,
-                Filters=[
-                    {
-                        'Name': 'tag:samplekey',
-                        'Condition': 'EQUALS',
-                        'Value': 'samplevalue'
-                    },
-                ]
-            )
-        else:
-            break
-    while pending_conversion_tasks: 
-        for task_id, account_id in pending_conversion_tasks.items():
-            task_completed = get_license_conversion_task_status(account_id, task_id)
-            if task_completed == True: 
-                del pending_conversion_tasks[task_id]
+    # Collect the resources of every page first, then start their conversions concurrently
+    conversion_requests = []
+    for response in pages:
+        if verbose:
+            print('AWS License Manager - ListResourceInventory API response:')
+            pprint.pprint(response)
+        for resource in response.get('ResourceInventoryList', []):
+            resource_arn = resource['ResourceArn']
+            # The account ID is the fifth field of the ARN, the resource part is not split
+            conversion_requests.append((resource_arn.split(':', 5)[4], resource_arn))
+
+    # One pool of workers is shared by the role assumption, conversion and polling phases.
+    # A throttling error cancels the queued calls before it is raised, otherwise leaving the
+    # with block would still wait for every queued conversion to run.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=default_max_workers) as executor:
+        # Assume the conversion role once per account, concurrently, before any conversion starts.
+        # An account that fails here is reported for each of its resources by the conversions below.
+        accounts = {account_id for account_id, _ in conversion_requests}
+        futures = [executor.submit(get_client_using_assume_role, account_id, default_region) for account_id in accounts]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except ClientError as e:
+                if e.response['Error']['Code'] in throttling_error_codes:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+
+        # Resources are grouped by account, so the conversions of an account run back to back on
+        # its cached assumed-role client, and a resource listed more than once is converted once.
+        # The conversions are rate limited by the token bucket, and a failed conversion is
+        # reported for its resource without stopping the others.
+        conversion_requests = sorted(set(conversion_requests))
+        pending_conversion_tasks = {}
+        futures = {
+            executor.submit(create_license_conversion_task, account_id, resource_arn, SourceContext, DestinationContext): (account_id, resource_arn)
+            for account_id, resource_arn in conversion_requests
+        }
+        for future in concurrent.futures.as_completed(futures):
+            account_id, resource_arn = futures[future]
+            try:
+                conversion_task_response = future.result()
+            except (ClientError, LicenseConversionError) as e:
+                if isinstance(e, ClientError) and e.response['Error']['Code'] in throttling_error_codes:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                print(f'AWS License Manager - CreateLicenseConversionTask failed for {resource_arn}: {e}')
+                continue
+            pending_conversion_tasks[conversion_task_response['LicenseConversionTaskId']] = account_id
+
+        print(f'AWS License Manager - started {len(pending_conversion_tasks)} of {len(conversion_requests)} license conversion tasks')
+
+        # Check the pending tasks concurrently and keep the unfinished ones for the next round. The
+        # wait between rounds doubles up to default_max_poll_interval to stay clear of throttling.
+        # A failed task is reported with its status message and is not polled again.
+        failed_conversion_tasks = len(conversion_requests) - len(pending_conversion_tasks)
+        poll_interval = 1
+        while pending_conversion_tasks:
+            futures = {
+                executor.submit(get_license_conversion_task_status, account_id, task_id): (task_id, account_id)
+                for task_id, account_id in pending_conversion_tasks.items()
+            }
+            pending_conversion_tasks = {}
+            for future in concurrent.futures.as_completed(futures):
+                task_id, account_id = futures[future]
+                try:
+                    status, status_message = future.result()
+                except ClientError as e:
+                    if e.response['Error']['Code'] in throttling_error_codes:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    print(f'AWS License Manager - GetLicenseConversionTask failed for {task_id}: {e}')
+                    failed_conversion_tasks += 1
+                    continue
+                if status == 'FAILED':
+                    print(f'AWS License Manager - license conversion task {task_id} failed: {status_message}')
+                    failed_conversion_tasks += 1
+                elif status != 'SUCCEEDED':
+                    pending_conversion_tasks[task_id] = account_id
+            if pending_conversion_tasks:
+                time.sleep(poll_interval)
+                poll_interval = min(default_max_poll_interval, poll_interval * 2)
+    print(f'AWS License Manager - all license conversion tasks have finished, {failed_conversion_tasks} of {len(conversion_requests)} failed')
     return
 
+# Helper method to create a client from the shared session
+def create_client(Service, Region, **kwargs):
+    with shared_session_lock:
+        return shared_session.client(Service, Region, config=client_config, **kwargs)
+
+# Clients are cached per region, so every helper shares one client and its connection pool
+@functools.lru_cache(maxsize=None)
 def get_client(Region):
-    return boto3.client('license-manager', Region)
+    return create_client('license-manager', Region)
+
+@functools.lru_cache(maxsize=None)
+def get_sts_client(Region):
+    return create_client('sts', Region)
 
 def get_client_using_assume_role(AccountId, Region):
-    sts_client = boto3.client('sts')
-    response = sts_client.assume_role(
-        RoleArn="arn:aws:iam::{}:role/{}".format(AccountId, default_role),
-        RoleSessionName="AssumeRoleSession1"
-    )
-    session = Session(aws_access_key_id=response['Credentials']['AccessKeyId'],
-                      aws_secret_access_key=response['Credentials']['SecretAccessKey'],
-                      aws_session_token=response['Credentials']['SessionToken'])
-    return session.client('license-manager', Region)
+    # Callers for the same account and region wait on one lock, so a single AssumeRole call
+    # fills the cache for all of them
+    with assumed_role_clients_lock:
+        account_lock = assumed_role_locks.setdefault((AccountId, Region), threading.Lock())
+    with account_lock:
+        cached = assumed_role_clients.get((AccountId, Region))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if cached is not None and cached[1] - now > assumed_role_expiry_margin:
+            return cached[0]
+
+        response = get_sts_client(Region).assume_role(
+            RoleArn="arn:aws:iam::{}:role/{}".format(AccountId, default_role),
+            RoleSessionName="AssumeRoleSession1"
+        )
+        client = create_client('license-manager', Region,
+                               aws_access_key_id=response['Credentials']['AccessKeyId'],
+                               aws_secret_access_key=response['Credentials']['SecretAccessKey'],
+                               aws_session_token=response['Credentials']['SessionToken'])
+        assumed_role_clients[(AccountId, Region)] = (client, response['Credentials']['Expiration'])
+        return client
 
 def main(command_line=None):
     print("Start of the License Conversion Tasks samples")
     
     # Convert BYOL to license included (LI) for all windows resources in the AWS Organization
-    convert_BYOL_to_license_included_for_all_resources()
+    convert_license_for_all_resources('RunInstances:0800', 'RunInstances:0002')
     
+    # The reverse conversion, license included (LI) to BYOL, would be
+    # convert_license_for_all_resources('RunInstances:0002', 'RunInstances:0800')
     # For other type of suppoerted conversions please visit: https://docs.aws.amazon.com/license-manager/latest/userguide/conversion-types.html
     
 if __name__ == '__main__':
@@ -1,11 +1,47 @@
 import boto3
 import base64
 import datetime
+import functools
 import pprint
 import uuid
+from botocore.config import Config
 
 default_region = 'us-east-1'
 
+# Shared client configuration: adaptive retries so throttled calls back off on the client instead
+# of failing, TCP keep-alive so pooled connections stay warm between calls, and short timeouts so
+# a dropped connection is retried instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 10}
+)
+
+# Tag based exclusion rules applied by update_license_configuration_with_exclusion_rules. botocore
+# does not modify request parameters, so the list is shared between calls instead of rebuilt.
+default_exclusion_rules = [
+    {
+        'ResourceType': 'SSM_MANAGED',
+        'ProductInformationFilterList': [
+            {
+                'ProductInformationFilterName': 'Tag:samplekey',
+                'ProductInformationFilterValue': [
+                    'samplevalue', #optional 
+                ],
+                'ProductInformationFilterComparator': 'NOT_EQUALS'
+            },
+            {
+                'ProductInformationFilterName': 'Application Name',
+                'ProductInformationFilterValue': [
+                    'windows',
+                ],
+                'ProductInformationFilterComparator': 'EQUALS'
+            },
+        ]
+    }
+]
+
 def create_license_configuration(Name, LicenseCountingType):
     lm_client = get_client(default_region)
     response = lm_client.create_license_configuration(
@@ -33,27 +69,7 @@ def update_license_configuration_with_exclusion_rules(LicenseConfigurationArn):
     lm_client = get_client(default_region)
     response = lm_client.update_license_configuration(
         LicenseConfigurationArn = LicenseConfigurationArn,
-        ProductInformationList=[
-        {
-            'ResourceType': 'SSM_MANAGED',
-            'ProductInformationFilterList': [
-                {
-                    'ProductInformationFilterName': 'Tag:samplekey',
-                    'ProductInformationFilterValue': [
-                        'samplevalue', #optional 
-                    ],
-                    'ProductInformationFilterComparator': 'NOT_EQUALS'
-                },
-                {
-                    'ProductInformationFilterName': 'Application Name',
-                    'ProductInformationFilterValue': [
-                        'windows',
-                    ],
-                    'ProductInformationFilterComparator': 'EQUALS'
-                },
-            ]
-        },
-    ],
+        ProductInformationList = default_exclusion_rules,
     )
     print('AWS License Manager - UpdateLicenseConfiguration API response:')
     pprint.pprint(response)
@@ -68,15 +84,17 @@ def delete_license_configuration(LicenseConfigurationArn):
     pprint.pprint(response)
 
 
+# Clients are cached per region, so every helper shares one client and its connection pool
+@functools.lru_cache(maxsize=None)
 def get_client(Region):
-    return boto3.client('license-manager', Region)
+    return boto3.client('license-manager', Region, config=client_config)
 
 def main(command_line=None):
     print("Start of the self-managed license sample model 1")
     model_1_license_configuration_name = "TestLicenseConfiguration_1"
     model_1_license_counting_type = "Instance"
 
-    client = boto3.client("sts")
+    client = boto3.client("sts", config=client_config)
     account_id = client.get_caller_identity()["Account"]
 
     # Creating a sample license configuration for tracking instances
@@ -1,11 +1,61 @@
 import boto3
 import base64
+import concurrent.futures
 import datetime
+import functools
+import json
+import os
 import pprint
+import random
+import sys
 import uuid
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 default_region = 'us-east-1'
-default_account = '062544142987' #sample
+
+# Page size for DescribeInstances, 1000 is the largest page the API returns
+default_instance_page_size = 1000
+
+# Instances whose license specifications are updated
+default_instance_filters = [
+    {
+        'Name': 'tag:testsample',
+        'Values': [
+            'samplekey',
+        ]
+    },
+]
+
+# The per-resource responses are only printed when LM_SAMPLE_VERBOSE=1, since the sample can
+# touch every resource in the account. By default one summary line is printed once every
+# instance has been processed.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '0') == '1'
+
+# The update call does not need to be read back. Set LM_SAMPLE_VERIFY=1 to list the license
+# specifications of a few updated resources, picked at random, once all updates are done.
+verify = os.environ.get('LM_SAMPLE_VERIFY') == '1'
+default_verify_sample_size = 5
+
+# Number of resources updated at the same time
+default_max_workers = 16
+default_max_in_flight = default_max_workers * 4
+
+# Error codes returned once a throttled call has used up its retries. These stop the sample
+# instead of being reported per resource, since continuing would only add to the throttling.
+throttling_error_codes = frozenset({'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', 'RateLimitExceededException'})
+
+# Shared client configuration: a connection pool large enough for the workers, adaptive retries
+# so throttled calls back off on the client instead of failing, TCP keep-alive so pooled
+# connections stay warm between calls, and short timeouts so a dropped connection is retried
+# instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = max(32, default_max_workers * 2),
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 10}
+)
 
 def create_license_configuration(Name, LicenseCountingType):
     lm_client = get_lm_client(default_region)
@@ -30,72 +80,123 @@ def get_license_configuration(LicenseConfigurationArn):
     return response
 
 
+# Serializes a response with the C json encoder, which is much cheaper than pprint for the
+# large pages returned by the paginated calls
+dump_response = functools.partial(json.dumps, default=str, indent=2)
+
+# Helper method to write a response to stdout
+def write_response(response):
+    sys.stdout.write(dump_response(response))
+    sys.stdout.write('\n')
+
+# Helper method to add the license configuration to a resource. The client is passed in,
+# since it is shared by the worker threads.
+def add_license_specification(LicenseManagerClient, LicenseConfigurationArn, ResourceArn):
+    return LicenseManagerClient.update_license_specifications_for_resource(
+        ResourceArn = ResourceArn,
+        AddLicenseSpecifications=[
+            {
+                'LicenseConfigurationArn': LicenseConfigurationArn
+            },
+        ],
+    )
+
+# Helper method to list the license specifications of a sample of the updated resources
+def verify_license_specifications(LicenseManagerClient, ResourceArns):
+    for resource_arn in random.sample(ResourceArns, min(default_verify_sample_size, len(ResourceArns))):
+        response = LicenseManagerClient.list_license_specifications_for_resource(
+            ResourceArn = resource_arn,
+        )
+        print(f'AWS License Manager - ListLicenseSpecificationsForResource API response for {resource_arn}:')
+        write_response(response)
+
+# Helper method to yield the ARN of every instance that matches the filters. Pages are fetched
+# as the ARNs are consumed, so only one page is held in memory at a time.
+def iter_instance_arns(Ec2Client, Filters, Region, AccountId):
+    arn_prefix = f"arn:aws:ec2:{Region}:{AccountId}:instance/"
+    paginator = Ec2Client.get_paginator('describe_instances')
+    for response in paginator.paginate(
+            Filters = Filters,
+            PaginationConfig={'PageSize': default_instance_page_size}
+        ):
+        if verbose:
+            print('EC2 DescribeInstances API response:')
+            write_response(response)
+        for reservation in response.get('Reservations', []):
+            for resource in reservation['Instances']:
+                yield arn_prefix + resource['InstanceId']
+
 # sample function to update license specifications for all ec2 instances based on tags
-def update_license_specifications_for_all_ec2_tagged_instances(LicenseConfigurationArn):
+def update_license_specifications_for_all_ec2_tagged_instances(LicenseConfigurationArn, AccountId):
     lm_client = get_lm_client(default_region)
     ec2_client = get_ec2_client(default_region)
-    
-    response = ec2_client.describe_instances(
-            Filters=[
-                {
-                    'Name': 'tag:testsample',
-                    'Values': [
-                            'samplekey',
-                        ]
-                },
-            ]
-        )
-    while True:
-        print('EC2 DescribeInstances API response:')
-        pprint.pprint(response)
-        if "Reservations" in response:
-            reservations = response['Reservations']
-            instances = reservations[0]['Instances']
-            for resource in instances:
-                resource_arn = "arn:aws:ec2:{}:{}:instance/{}".format(default_region, default_account, resource['InstanceId'])
-                lm_client.update_license_specifications_for_resource(
-                    ResourceArn = resource_arn,
-                    AddLicenseSpecifications=[
-                        {
-                            'LicenseConfigurationArn': LicenseConfigurationArn
-                        },
-                    ],
-                )
-                list_response = lm_client.list_license_specifications_for_resource(
-                    ResourceArn=resource_arn,
-                )
-                pprint.pprint(list_response)
-        if "NextToken" in response:
-            next_token = response['NextToken']
-            response = ec2_client.describe_instances(
-                Filters = [
-                    {
-                        'Name': 'tag:samplekey',
-                        'Values': [
-                            'samplekey',
-                        ]
-                    },
-                ],
-                NextToken = next_token
-            )
-        else: 
-            break
-    return response
+    resource_arns = iter_instance_arns(ec2_client, default_instance_filters, default_region, AccountId)
 
+    # The instances are updated concurrently. At most default_max_in_flight updates are queued
+    # at a time, so the ARNs are pulled from the paginator as the workers catch up. A failed
+    # update is reported for its instance and does not stop the others.
+    updated_resource_arns = []
+    submitted = 0
+    updated = 0
+    in_flight = {}
+    seen_resource_arns = set()
 
+    def collect(futures):
+        nonlocal updated
+        for future in futures:
+            resource_arn = in_flight.pop(future)
+            try:
+                future.result()
+            except ClientError as e:
+                if e.response['Error']['Code'] in throttling_error_codes:
+                    # Cancel the queued updates, leaving the with block would run them first
+                    for pending in in_flight:
+                        pending.cancel()
+                    raise
+                print(f'AWS License Manager - UpdateLicenseSpecificationsForResource failed for {resource_arn}: {e}')
+                continue
+            updated += 1
+            if verify:
+                updated_resource_arns.append(resource_arn)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=default_max_workers) as executor:
+        for resource_arn in resource_arns:
+            # An instance listed more than once is only updated the first time
+            if resource_arn in seen_resource_arns:
+                continue
+            seen_resource_arns.add(resource_arn)
+            if len(in_flight) >= default_max_in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(add_license_specification, lm_client, LicenseConfigurationArn, resource_arn)] = resource_arn
+            submitted += 1
+        collect(list(concurrent.futures.as_completed(in_flight)))
+    print(f'AWS License Manager - {updated} of {submitted} instances updated')
+
+    if verify:
+        verify_license_specifications(lm_client, updated_resource_arns)
+
+
+# Clients are cached per region, so every helper shares one client and its connection pool
+@functools.lru_cache(maxsize=None)
 def get_lm_client(Region):
-    return boto3.client('license-manager', Region)
+    return boto3.client('license-manager', Region, config=client_config)
 
+@functools.lru_cache(maxsize=None)
 def get_ec2_client(Region):
-    return boto3.client('ec2', Region)
+    return boto3.client('ec2', Region, config=client_config)
+
+# The caller identity does not change during the program, so it is only fetched once
+@functools.lru_cache(maxsize=1)
+def get_account_id():
+    return boto3.client("sts", config=client_config).get_caller_identity()["Account"]
 
 def main(command_line=None):
     print("Start of the self-managed license sample - UpdateLicenseSpecifications tag based")
     model_1_license_configuration_name = "TestLicenseConfiguration_1"
     model_1_license_counting_type = "Instance"
 
-    client = boto3.client("sts")
-    account_id = client.get_caller_identity()["Account"]
+    account_id = get_account_id()
 
     # Creating a sample license configuration for tracking instances
     license_configuration = create_license_configuration(model_1_license_configuration_name, model_1_license_counting_type)
@@ -104,7 +205,7 @@ def main(command_line=None):
     get_license_configuration(license_configuration['LicenseConfigurationArn'])
 
     # Updates license specifications for tagged ec2 instances using the sample license configuration and tags
-    update_license_specifications_for_all_ec2_tagged_instances(['LicenseConfigurationArn'])
+    update_license_specifications_for_all_ec2_tagged_instances(license_configuration['LicenseConfigurationArn'], account_id)
     
 
 if __name__ == '__main__':
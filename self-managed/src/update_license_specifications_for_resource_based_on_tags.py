@@ -1,11 +1,50 @@
 import boto3
 import base64
+import concurrent.futures
 import datetime
+import functools
+import json
+import os
 import pprint
+import random
+import sys
 import uuid
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 default_region = 'us-east-1'
 
+# Page size for the List calls. A larger page needs fewer round trips to walk the inventory.
+default_page_size = 100
+
+# The per-resource responses are only printed when LM_SAMPLE_VERBOSE=1, since the sample can
+# touch every resource in the account. By default one summary line is printed per page.
+verbose = os.environ.get('LM_SAMPLE_VERBOSE', '0') == '1'
+
+# The update call does not need to be read back. Set LM_SAMPLE_VERIFY=1 to list the license
+# specifications of a few updated resources, picked at random, once all updates are done.
+verify = os.environ.get('LM_SAMPLE_VERIFY') == '1'
+default_verify_sample_size = 5
+
+# Number of resources updated at the same time
+default_max_workers = 16
+
+# Error codes returned once a throttled call has used up its retries. These stop the sample
+# instead of being reported per resource, since continuing would only add to the throttling.
+throttling_error_codes = frozenset({'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException', 'RateLimitExceededException'})
+
+# Shared client configuration: a connection pool large enough for the workers, adaptive retries
+# so throttled calls back off on the client instead of failing, TCP keep-alive so pooled
+# connections stay warm between calls, and short timeouts so a dropped connection is retried
+# instead of stalling for the 60 second default
+client_config = Config(
+    connect_timeout = 3,
+    read_timeout = 10,
+    max_pool_connections = max(32, default_max_workers * 2),
+    tcp_keepalive = True,
+    retries = {'mode': 'adaptive', 'max_attempts': 10}
+)
+
 def create_license_configuration(Name, LicenseCountingType):
     lm_client = get_client(default_region)
     response = lm_client.create_license_configuration(
@@ -29,63 +68,105 @@ def get_license_configuration(LicenseConfigurationArn):
     return response
 
 
+# Serializes a response with the C json encoder, which is much cheaper than pprint for the
+# large pages returned by the paginated calls
+dump_response = functools.partial(json.dumps, default=str, indent=2)
+
+# Helper method to write a response to stdout
+def write_response(response):
+    sys.stdout.write(dump_response(response))
+    sys.stdout.write('\n')
+
+# Helper method to add the license configuration to a resource. The client is passed in,
+# since it is shared by the worker threads.
+def add_license_specification(LicenseManagerClient, LicenseConfigurationArn, ResourceArn):
+    return LicenseManagerClient.update_license_specifications_for_resource(
+        ResourceArn = ResourceArn,
+        AddLicenseSpecifications=[
+            {
+                'LicenseConfigurationArn': LicenseConfigurationArn
+            },
+        ],
+    )
+
+# Helper method to list the license specifications of a sample of the updated resources
+def verify_license_specifications(LicenseManagerClient, ResourceArns):
+    for resource_arn in random.sample(ResourceArns, min(default_verify_sample_size, len(ResourceArns))):
+        response = LicenseManagerClient.list_license_specifications_for_resource(
+            ResourceArn = resource_arn,
+        )
+        print(f'AWS License Manager - ListLicenseSpecificationsForResource API response for {resource_arn}:')
+        write_response(response)
+
 # sample function to update license specifications based on tags
 def update_license_specifications_for_tagged_resources(LicenseConfigurationArn):
     lm_client = get_client(default_region)
-    response = lm_client.list_resource_inventory(
-            MaxResults=20,
-            Filters=[
-                {
-                    'Name': 'tag:samplekey',
-                    'Condition': 'EQUALS',
-                    'Value': 'samplevalue'
-                },
-            ]
-        )
-    while True:
-        print('AWS License Manager - ListResourceInventory API response:')
-        pprint.pprint(response)
-        if "ResourceInventoryList" in response:
-            for resource in response['ResourceInventoryList']:
-                lm_client.update_license_specifications_for_resource(
-                    ResourceArn=resource['ResourceArn'],
-                    AddLicenseSpecifications=[
-                        {
-                            'LicenseConfigurationArn': LicenseConfigurationArn
-                        },
-                    ],
-                )
-                list_response = lm_client.list_license_specifications_for_resource(
-                    ResourceArn=resource['ResourceArn'],
-                )
-                pprint.pprint(list_response)
-        if "NextToken" in response:
-            next_token = response['NextToken']
-            response = lm_client.list_resource_inventory(
-                NextToken=next_token,
+    paginator = lm_client.get_paginator('list_resource_inventory')
+    updated_resource_arns = []
+    seen_resource_arns = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=default_max_workers) as executor:
+        for page_number, response in enumerate(paginator.paginate(
                 Filters=[
                     {
                         'Name': 'tag:samplekey',
                         'Condition': 'EQUALS',
                         'Value': 'samplevalue'
                     },
-                ]
-            )
-        else: 
-            break
-    return response
+                ],
+                PaginationConfig={'PageSize': default_page_size}
+            ), start=1):
+            if verbose:
+                print('AWS License Manager - ListResourceInventory API response:')
+                write_response(response)
+            # The resources are updated concurrently. A failed update is reported for
+            # its resource and does not stop the others.
+            # A resource listed more than once is only updated the first time
+            resource_arns = [
+                resource_arn
+                for resource_arn in dict.fromkeys(resource['ResourceArn'] for resource in response.get('ResourceInventoryList', []))
+                if resource_arn not in seen_resource_arns
+            ]
+            seen_resource_arns.update(resource_arns)
+            futures = {
+                executor.submit(add_license_specification, lm_client, LicenseConfigurationArn, resource_arn): resource_arn
+                for resource_arn in resource_arns
+            }
+            updated = 0
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except ClientError as e:
+                    if e.response['Error']['Code'] in throttling_error_codes:
+                        # Cancel the queued updates, leaving the with block would run them first
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    print(f'AWS License Manager - UpdateLicenseSpecificationsForResource failed for {futures[future]}: {e}')
+                    continue
+                updated += 1
+                if verify:
+                    updated_resource_arns.append(futures[future])
+            print(f'AWS License Manager - page {page_number}: {updated} of {len(futures)} resources updated')
 
+    if verify:
+        verify_license_specifications(lm_client, updated_resource_arns)
 
+
+# Clients are cached per region, so every helper shares one client and its connection pool
+@functools.lru_cache(maxsize=None)
 def get_client(Region):
-    return boto3.client('license-manager', Region)
+    return boto3.client('license-manager', Region, config=client_config)
+
+# The caller identity does not change during the program, so it is only fetched once
+@functools.lru_cache(maxsize=1)
+def get_account_id():
+    return boto3.client("sts", config=client_config).get_caller_identity()["Account"]
 
 def main(command_line=None):
     print("Start of the self-managed license sample - UpdateLicenseSpecifications tag based")
     model_1_license_configuration_name = "TestLicenseConfiguration_1"
     model_1_license_counting_type = "Instance"
 
-    client = boto3.client("sts")
-    account_id = client.get_caller_identity()["Account"]
+    account_id = get_account_id()
 
     # Creating a sample license configuration for tracking instances
     license_configuration = create_license_configuration(model_1_license_configuration_name, model_1_license_counting_type)